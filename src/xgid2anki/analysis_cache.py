@@ -0,0 +1,92 @@
+# xgid2anki - Convert a set of backgammon XGIDs into an Anki study deck
+# Copyright (c) 2025 Nicholas G. Vlamis
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""xgid2anki.analysis_cache
+
+On-disk cache of parsed GNUBG analyses, so positions that reappear across
+runs (e.g. while refining a deck) are not sent to GNUBG again.
+
+Entries live in a small SQLite database in the per-user cache directory
+determined by `platformdirs.user_cache_dir(APP_NAME)`. Each entry is keyed by
+``(xgid, plies, cube_plies)`` and holds the parsed position dict (see
+:func:`xgid2anki.parse_gnubg_eval.parse_position`) pickled with protocol 5.
+
+Bump ``_TABLE`` whenever the shape of the parsed position dicts changes, so
+stale entries are simply never read again.
+"""
+
+from __future__ import annotations
+
+import pickle
+import sqlite3
+from pathlib import Path
+
+from platformdirs import user_cache_dir
+
+from .download_bglog import APP_NAME
+
+_CACHE_FILENAME = "gnubg_analysis.sqlite"
+_TABLE = "analysis_v1"
+
+
+def get_cache_path() -> Path:
+    """Canonical location for the analysis cache database."""
+    cache_dir = Path(user_cache_dir(APP_NAME))  # e.g. Linux: ~/.cache/xgid2anki
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return cache_dir / _CACHE_FILENAME
+
+
+def open_cache(path: Path | None = None) -> sqlite3.Connection:
+    """Open (creating if needed) the analysis cache at ``path``."""
+    conn = sqlite3.connect(path or get_cache_path())
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {_TABLE} ("
+        " xgid TEXT NOT NULL,"
+        " plies INTEGER NOT NULL,"
+        " cube_plies INTEGER NOT NULL,"
+        " result BLOB NOT NULL,"
+        " PRIMARY KEY (xgid, plies, cube_plies))"
+    )
+    return conn
+
+
+def load_cached(
+    conn: sqlite3.Connection, xgids, plies: int, cube_plies: int
+) -> dict[str, dict]:
+    """Return ``{xgid: analysis}`` for every XGID in ``xgids`` found in the cache.
+
+    An entry that cannot be unpickled, or that is not a parsed position dict,
+    counts as a miss, so the position is analyzed again and
+    :func:`store_results` replaces it.
+    """
+    hits = {}
+    for xgid in xgids:
+        row = conn.execute(
+            f"SELECT result FROM {_TABLE} WHERE xgid=? AND plies=? AND cube_plies=?",
+            (xgid, plies, cube_plies),
+        ).fetchone()
+        if row is None:
+            continue
+        try:
+            analysis = pickle.loads(row[0])
+        except Exception:
+            # A corrupt blob can fail in many ways; none may abort the run
+            continue
+        if isinstance(analysis, dict) and "xgid" in analysis:
+            hits[xgid] = analysis
+    return hits
+
+
+def store_results(
+    conn: sqlite3.Connection, analyses: dict[str, dict], plies: int, cube_plies: int
+) -> None:
+    """Insert or replace ``{xgid: analysis}`` entries in the cache."""
+    with conn:
+        conn.executemany(
+            f"INSERT OR REPLACE INTO {_TABLE} (xgid, plies, cube_plies, result)"
+            " VALUES (?, ?, ?, ?)",
+            [
+                (xgid, plies, cube_plies, pickle.dumps(analysis, protocol=5))
+                for xgid, analysis in analyses.items()
+            ],
+        )
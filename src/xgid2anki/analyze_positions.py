@@ -4,9 +4,18 @@
 """xgid2anki.analyze_positions
 Analyze backgammon positions with GNU Backgammon (GNUBG).
 
-This module batches XGIDs, invokes GNUBG once per batch (via a Python 2
-script that runs inside GNUBG), collects JSON analysis through a pipe, and
-returns results in the same order as the input XGIDs.
+This module batches XGIDs, hands them to GNUBG (via a Python 2 script that
+runs inside GNUBG), collects the pickled analysis, and returns results in the
+same order as the input XGIDs. The GNUBG text is parsed by
+:mod:`xgid2anki.parse_gnubg_eval` inside GNUBG, so each result is already a
+structured position dict.
+
+Positions already analyzed at the same depths in an earlier run are served
+from :mod:`xgid2anki.analysis_cache` instead of being sent to GNUBG again.
+
+On POSIX a pool of long-lived GNUBG workers is started once and fed batches
+over inherited pipes. Windows lacks ``pass_fds``, so there GNUBG is invoked
+once per batch and writes its result to a temporary file.
 
 Intended to be called from :func:`xgid2anki.pipeline.xgid2anki_pipeline`; emits progress via
 :mod:`logging` but performs no console I/O.
@@ -14,133 +23,371 @@ Intended to be called from :func:`xgid2anki.pipeline.xgid2anki_pipeline`; emits
 
 import os
 import json
+import logging
+import pickle
+import queue
+import sqlite3
 import subprocess
 import platform
 import tempfile
 from pathlib import Path
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .analysis_cache import open_cache, load_cached, store_results
+
+logger = logging.getLogger(__name__)
+
+# Persistent workers pull this many smaller batches each (on average) from a
+# shared queue, so one slow, hard position cannot leave the others idle.
+BATCHES_PER_WORKER = 4
+
+
+def default_procs():
+    """Number of GNUBG workers to use: the CPUs we may run on, minus one for the coordinator."""
+    try:
+        # Honors cgroup / taskset CPU pinning, unlike os.cpu_count() (Linux)
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    return max(1, cpus - 1)
 
 
 def split_into_n(seq, n):
     n = max(1, int(n))
-    L = len(seq)
-    q, r = divmod(L, n)
-    out, i = [], 0
-    for k in range(n):
-        sz = q + (1 if k < r else 0)
-        if sz:
-            out.append(seq[i : i + sz])
-            i += sz
-    return out
+    q, r = divmod(len(seq), n)
+    # The first r parts get one extra item; part k starts at k*q + min(k, r)
+    bounds = [k * q + min(k, r) for k in range(n + 1)]
+    return [seq[a:b] for a, b in zip(bounds, bounds[1:]) if a < b]
+
+
+def _gnubg_args():
+    """Command line that runs gnubg_pos_analysis.py inside GNUBG."""
+    # On Windows we expect gnubg-cli.exe / gnubg-cli in PATH.
+    # On Unix-y systems we expect gnubg to be callable.
+    system = platform.system().lower()
+    if system == "windows":
+        gnubg_command = "gnubg-cli"
+    else:
+        gnubg_command = "gnubg"
+
+    gnubg_script = Path(__file__).parent / "gnubg_pos_analysis.py"
+    return [gnubg_command, "-t", "-q", "-p", gnubg_script]
+
+
+def _gnubg_env(ply, cply):
+    """Environment for the child process (GNUBG) with the ply / cube_plies settings."""
+    env = os.environ.copy()
+    env["XGID2ANKI_DIR"] = str(Path(__file__).parent)
+    env["PLIES"] = str(ply)
+    env["CUBE_PLIES"] = str(cply)
+    return env
+
+
+def _chatter_streams():
+    """Return (stdout, stderr) for GNUBG: our own if XGID2ANKI_DEBUG is set, else discarded."""
+    if os.environ.get("XGID2ANKI_DEBUG"):
+        return None, None  # inherit, so GNUBG's chatter reaches the terminal
+    return subprocess.DEVNULL, subprocess.DEVNULL
+
+
+def _check_parse_errors(analysis):
+    """Raise ValueError for the first position GNUBG could not parse, with its traceback."""
+    for a in analysis:
+        if isinstance(a, dict) and "error" in a:
+            raise ValueError(
+                'Could not parse GNUBG analysis of "%s":\n%s' % (a["xgid"], a["error"])
+            )
+
+
+def _returncode(proc):
+    """Exit code of a GNUBG process that is exiting, waiting briefly for it."""
+    try:
+        return proc.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        return None
+
+
+class GnubgWorker:
+    """
+    A long-lived GNUBG process running gnubg_pos_analysis.py in worker mode (POSIX).
+
+    Batches go to GNUBG as JSON lines over an inherited REQUEST_FD pipe and
+    the replies come back, one pickle each, over RESULT_FD, so GNUBG starts
+    (and loads its neural nets) once per worker instead of once per batch.
+    """
+
+    def __init__(self, ply, cply):
+        env = _gnubg_env(ply, cply)
+        stdout, stderr = _chatter_streams()
+        req_r, req_w = os.pipe()
+        res_r, res_w = os.pipe()
+        env["REQUEST_FD"] = str(req_r)
+        env["RESULT_FD"] = str(res_w)
+        try:
+            self._proc = subprocess.Popen(
+                _gnubg_args(),
+                env=env,
+                stdout=stdout,
+                stderr=stderr,
+                pass_fds=(req_r, res_w),
+            )
+        except BaseException:
+            os.close(req_w)
+            os.close(res_r)
+            raise
+        finally:
+            # Only the child holds these ends now, so we see EOF if GNUBG exits.
+            os.close(req_r)
+            os.close(res_w)
+
+        self._requests = os.fdopen(req_w, "w", encoding="utf-8")
+        self._results = os.fdopen(res_r, "rb", 65536)
+
+    def analyze(self, xgids):
+        """Send one batch of XGIDs to GNUBG and block until its analysis comes back."""
+        try:
+            self._requests.write(json.dumps({"xgids": xgids}) + "\n")
+            self._requests.flush()
+            # GNUBG is the only writer and runs our own script, so unpickling is safe
+            analysis = pickle.load(self._results)
+        except (BrokenPipeError, EOFError, pickle.UnpicklingError):
+            # A worker that dies mid-reply leaves a truncated pickle behind
+            raise RuntimeError(
+                "GNUBG worker exited before returning its analysis (rc=%s)"
+                % _returncode(self._proc)
+            ) from None
+        _check_parse_errors(analysis)
+        return analysis
+
+    def close(self):
+        """Let GNUBG exit by closing REQUEST_FD; return its returncode."""
+        try:
+            self._requests.close()
+        except OSError:
+            pass  # GNUBG already exited; its returncode tells the story
+        returncode = self._proc.wait()
+        self._results.close()
+        return returncode
 
 
-def run_gnubg_batch(indexed_batch, ply, cply):
-    """Invoke GNUBG once for a batch of XGIDs."""
+def run_gnubg_batch(indexed_batch, ply, cply, result_path):
+    """Invoke GNUBG once for a batch of XGIDs, reusing result_path (Windows)."""
 
     indices = [i for (i, _) in indexed_batch]
     xgids = [x for (_, x) in indexed_batch]
 
-    # 1. Create a temporary file path for GNUBG to write machine-readable JSON.
-    tmp = tempfile.NamedTemporaryFile(
-        delete=False,
-        prefix="gnubg_result_",
-        suffix=".json",
-    )
-    tmp_path = tmp.name
-    tmp.close()  # child (gnubg) will open this path itself
+    # 1. Empty the (reused) result file for GNUBG to write its pickled result,
+    #    so a failed run can never leave us reading the previous batch.
+    #    pass_fds is not supported on Windows, so we cannot use a pipe here.
+    os.truncate(result_path, 0)
 
     # 2. Build environment for the child process (GNUBG).
     #    We tell gnubg_pos_analysis.py:
     #      - which XGIDs to analyze
     #      - ply / cube_plies depth settings
-    #      - where to write the final JSON bundle
-    env = os.environ.copy()
+    #      - where to write the final pickled bundle
+    env = _gnubg_env(ply, cply)
     env["XGIDS"] = json.dumps(xgids)
-    env["PLIES"] = str(ply)
-    env["CUBE_PLIES"] = str(cply)
-    env["RESULT_JSON_PATH"] = tmp_path
+    env["RESULT_PATH"] = result_path
 
-    # 3. Work out which gnubg binary to call.
-    #    On Windows we expect gnubg-cli.exe / gnubg-cli in PATH.
-    #    On Unix-y systems we expect gnubg to be callable.
-    system = platform.system().lower()
-    if system == "windows":
-        gnubg_command = "gnubg-cli"
+    # 3. Launch GNUBG. Its stdout/stderr is discarded unless XGID2ANKI_DEBUG
+    #    is set, in which case it goes to our terminal; it is never parsed.
+    stdout, stderr = _chatter_streams()
+    completed = subprocess.run(
+        _gnubg_args(),
+        env=env,
+        stdout=stdout,
+        stderr=stderr,
+        check=False,
+    )
+
+    #
+    # 4. Read the structured analysis that gnubg_pos_analysis.py
+    #    should have pickled to result_path.
+    #
+    with open(result_path, "rb") as f:
+        try:
+            analysis = pickle.load(f)
+        except (EOFError, pickle.UnpicklingError):
+            # A GNUBG that dies mid-write leaves a truncated pickle behind
+            raise RuntimeError(
+                "GNUBG exited before writing its analysis (rc=%s)"
+                % completed.returncode
+            ) from None
+    _check_parse_errors(analysis)
+
+    # 5. Return (returncode, analysis_obj, indices, xgids_batch)
+    return completed.returncode, analysis, indices, xgids
+
+
+def _merge_batch(results, indices, xgids_batch, analysis):
+    """Merge one batch's analysis into the right slots of results."""
+    if isinstance(analysis, list):
+        # Assume analysis aligns positionally with xgids_batch
+        for idx, a in zip(indices, analysis):
+            results[idx] = a
+    elif isinstance(analysis, dict):
+        # Assume analysis keyed by XGID
+        for idx, x in zip(indices, xgids_batch):
+            results[idx] = analysis.get(x)
     else:
-        gnubg_command = "gnubg"
+        # Fallback: store raw analysis for the first slot
+        for idx in indices:
+            results[idx] = analysis
 
-    gnubg_script = Path(__file__).parent / "gnubg_pos_analysis.py"
-    gnubg_args = [gnubg_command, "-t", "-q", "-p", gnubg_script]
 
-    # 4. Launch GNUBG. We still capture stdout/stderr (merged) to `out`
-    #    in case we want to log/debug it, but we DO NOT try to parse it.
-    completed = None
-    analysis = None
+def _analyze_with_workers(batches, procs, plies, cube_plies, results):
+    """Feed batches to a pool of persistent GnubgWorkers; return the first nonzero rc."""
+    idle = queue.Queue()
+    workers = []
+
+    def run_batch(indexed_batch):
+        indices = [i for (i, _) in indexed_batch]
+        xgids_batch = [x for (_, x) in indexed_batch]
+        worker = idle.get()
+        try:
+            analysis = worker.analyze(xgids_batch)
+        finally:
+            idle.put(worker)
+        # Batches own disjoint slots, so each thread merges its own result
+        # while the other workers are still busy
+        _merge_batch(results, indices, xgids_batch, analysis)
+
+    rc = 0
     try:
-        completed = subprocess.run(
-            gnubg_args,
-            env=env,
-            text=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            check=False,
-        )
-
-        #
-        # 5. Read the structured analysis that gnubg_pos_analysis.py
-        #    should have written to tmp_path as valid JSON.
-        #
-        with open(tmp_path, "r", encoding="utf-8") as f:
-            analysis = json.load(f)
+        for _ in range(procs):
+            worker = GnubgWorker(plies, cube_plies)
+            workers.append(worker)
+            idle.put(worker)
 
+        with ThreadPoolExecutor(max_workers=procs) as ex:
+            futs = [ex.submit(run_batch, b) for b in batches]
+            try:
+                for fut in as_completed(futs):
+                    fut.result()  # re-raise the first failure
+            except BaseException:
+                # Drop queued batches; only the ones already running finish
+                ex.shutdown(wait=True, cancel_futures=True)
+                raise
     finally:
-        # 6. Cleanup temp file no matter what.
+        for worker in workers:
+            rcode = worker.close()
+            if rcode != 0 and rc == 0:
+                rc = rcode
+
+    return rc
+
+
+def _analyze_per_batch(batches, procs, plies, cube_plies, results):
+    """Run one GNUBG process per batch (Windows); return the first nonzero rc."""
+    # One result file per thread, created up front and handed from batch to batch
+    idle_paths = queue.Queue()
+    paths = []
+
+    def run_batch(indexed_batch):
+        result_path = idle_paths.get()
         try:
-            os.remove(tmp_path)
-        except OSError:
-            pass
+            rcode, analysis, indices, xgids_batch = run_gnubg_batch(
+                indexed_batch, plies, cube_plies, result_path
+            )
+        finally:
+            idle_paths.put(result_path)
+        # Batches own disjoint slots, so each thread merges its own result
+        _merge_batch(results, indices, xgids_batch, analysis)
+        return rcode
 
-    # 7. Return the same shape analyze_positions() already expects:
-    #    (returncode, analysis_obj, out, indices, xgids_batch)
+    rc = 0
+    try:
+        for _ in range(procs):
+            tmp = tempfile.NamedTemporaryFile(
+                delete=False,
+                prefix="gnubg_result_",
+                suffix=".pkl",
+            )
+            tmp.close()  # child (gnubg) will open this path itself
+            paths.append(tmp.name)
+            idle_paths.put(tmp.name)
 
-    out = completed.stdout if completed is not None else ""
+        # Each thread just waits on its GNUBG subprocess, so no worker processes needed
+        with ThreadPoolExecutor(max_workers=procs) as ex:
+            futs = [ex.submit(run_batch, b) for b in batches]
+            try:
+                for fut in as_completed(futs):
+                    rcode = fut.result()
+                    if rcode != 0 and rc == 0:
+                        rc = rcode
+            except BaseException:
+                # Drop queued batches; only the ones already running finish
+                ex.shutdown(wait=True, cancel_futures=True)
+                raise
+    finally:
+        # Cleanup temp files no matter what.
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
 
-    return completed.returncode, analysis, out, indices, xgids
+    return rc
 
 
-def analyze_positions(xgids, procs=0, plies=3, cube_plies=3):
-    """Analyze a collection of XGIDs with GNUBG, using a worker pool."""
-    if procs == 0:
-        procs = max(1, (os.cpu_count() or 1) - 2)
-    procs = min(procs, len(xgids))  # don’t spawn more workers than tasks
+def analyze_positions(xgids, procs=0, plies=3, cube_plies=3, use_cache=True):
+    """Analyze a collection of XGIDs with GNUBG, using a worker pool.
 
-    # Keep original order by indexing the xgids
-    indexed = list(enumerate(xgids))
-    batches = split_into_n(indexed, procs)
+    Each distinct XGID is analyzed once, however often it appears. With
+    ``use_cache``, cached analyses are reused and only the misses are sent to
+    GNUBG; fresh results are added to the cache if GNUBG succeeded.
+    """
+    cache = None
+    hits = {}
+    if use_cache:
+        try:
+            cache = open_cache()
+            hits = load_cached(cache, dict.fromkeys(xgids), plies, cube_plies)
+        except (sqlite3.Error, OSError) as e:
+            # An unusable cache database must not stop the run; analyze everything
+            logger.warning("Analysis cache unavailable, analyzing all positions: %s", e)
+            if cache is not None:
+                cache.close()
+            cache, hits = None, {}
+        if hits:
+            logger.info("Reusing cached analysis for %d position(s).", len(hits))
 
-    # Prepare result container in original order
-    results = [None] * len(xgids)
+    # Only distinct cache misses go to GNUBG; index them to keep their order
+    todo = [x for x in dict.fromkeys(xgids) if x not in hits]
+    indexed = list(enumerate(todo))
+    analyzed = [None] * len(todo)
 
     rc = 0
-    with ProcessPoolExecutor(max_workers=procs) as ex:
-        futs = [ex.submit(run_gnubg_batch, b, plies, cube_plies) for b in batches]
-        for fut in as_completed(futs):
-            rcode, analysis, out, indices, xgids_batch = fut.result()
-            if rcode != 0 and rc == 0:
-                rc = rcode
+    try:
+        if indexed:
+            if procs == 0:
+                procs = default_procs()
+            procs = min(procs, len(indexed))  # don’t spawn more workers than tasks
 
-            # Merge this batch’s analysis into the right slots
-            if isinstance(analysis, list):
-                # Assume analysis aligns positionally with xgids_batch
-                for idx, a in zip(indices, analysis):
-                    results[idx] = a
-            elif isinstance(analysis, dict):
-                # Assume analysis keyed by XGID
-                for idx, x in zip(indices, xgids_batch):
-                    results[idx] = analysis.get(x)
+            if platform.system().lower() == "windows":
+                # Every batch pays a GNUBG start-up here, so keep one per process
+                batches = split_into_n(indexed, procs)
+                rc = _analyze_per_batch(batches, procs, plies, cube_plies, analyzed)
             else:
-                # Fallback: store raw analysis for the first slot
-                for idx in indices:
-                    results[idx] = analysis
+                batches = split_into_n(indexed, procs * BATCHES_PER_WORKER)
+                rc = _analyze_with_workers(
+                    batches, procs, plies, cube_plies, analyzed
+                )
+
+        if cache is not None and rc == 0:
+            fresh = {x: a for x, a in zip(todo, analyzed) if a is not None}
+            try:
+                store_results(cache, fresh, plies, cube_plies)
+            except sqlite3.Error as e:
+                logger.warning("Could not update analysis cache: %s", e)
+    finally:
+        if cache is not None:
+            cache.close()
+
+    # Scatter back to the original order, duplicates included
+    found = dict(hits)
+    found.update(zip(todo, analyzed))
+    results = [found.get(x) for x in xgids]
 
     return results, rc
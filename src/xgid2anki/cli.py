@@ -32,6 +32,7 @@ from typing import Iterable, List, Tuple
 from .validate_xgid import validate_xgid
 from .download_bglog import download_bglog
 from .pipeline import xgid2anki_pipeline
+from .analyze_positions import default_procs
 from .ensure_headless_chromium import ensure_headless_chromium
 from .errors import ConfigError
 
@@ -171,9 +172,14 @@ def parse_args(argv: List[str] | None = None) -> argparse.Namespace:
     user_pref_group.add_argument(
         "-c",
         "--cores",
-        help="Worker processes (default: system CPU count - 1)",
+        help="Worker processes (default: available CPU count - 1)",
         type=int,
     )
+    user_pref_group.add_argument(
+        "--no-cache",
+        help="Re-analyze every position instead of reusing cached GNUBG analyses.",
+        action="store_true",
+    )
     user_pref_group.add_argument(
         "-k",
         "--keep_svg",
@@ -192,10 +198,7 @@ def parse_args(argv: List[str] | None = None) -> argparse.Namespace:
 
     # Dynamic defaults — compute only if user/config didn’t supply a value
     if args.cores is None:
-        import os
-
-        cores = os.cpu_count() or 1
-        args.cores = max(1, cores - 1)
+        args.cores = default_procs()
 
     return args
 
@@ -543,6 +546,7 @@ def main(argv: List[str] | None = None) -> int:
         board_theme=theme,
         keep_svg=args.keep_svg,
         output_path=output_path,
+        use_cache=not args.no_cache,
     )
 
 
@@ -6,92 +6,175 @@
 
 Runs **inside GNUBG** via::
 
-    XGIDS='[\"...\"]' PLIES=3 CUBE_PLIES=3 RESULT_JSON_PATH='C:\\Temp\\gnubg_result_abc123.json' \\
-+        gnubg -t -q -p gnubg_pos_analysis.py
+    XGIDS='[\"...\"]' PLIES=3 CUBE_PLIES=3 XGID2ANKI_DIR=... RESULT_FD=5 \\
+        gnubg -t -q -p gnubg_pos_analysis.py
 
 --------
 Input (env):
 - ``XGIDS``: JSON array of XGID strings.
 - ``PLIES``: integer search depth for moves (default: 3).
 - ``CUBE_PLIES``: integer search depth for cube (default: 3).
-- ``RESULT_JSON_PATH``: path to a writable file where this script will dump
-  one JSON array of analysis objects.
+- ``XGID2ANKI_DIR``: directory holding this script and
+  :mod:`xgid2anki.parse_gnubg_eval`, which is imported from there.
+- ``RESULT_FD``: number of an inherited, writable file descriptor (the write
+  end of a pipe held by the parent) where this script will pickle one list
+  of parsed position objects (see
+  :func:`xgid2anki.parse_gnubg_eval.parse_position`).
+- ``RESULT_PATH``: path to a writable file used instead of ``RESULT_FD`` on
+  Windows, where fds cannot be passed to the child.
 
 Output:
-- A single JSON document is written to RESULT_JSON_PATH.
+- A single pickle (highest protocol this interpreter supports) is written to
+  RESULT_FD (or RESULT_PATH). Both ends are trusted local processes.
   Nothing is guaranteed about stdout/stderr; they may contain GNUBG chatter.
+
+A position whose GNUBG output cannot be parsed is returned as
+``{"xgid": ..., "error": <traceback>}`` in place of its parsed object.
+
+Worker mode (POSIX):
+- If ``REQUEST_FD`` is also set, ``XGIDS`` is ignored. The script instead
+  reads requests of the form ``{"xgids": [...]}``, one JSON object per line,
+  from ``REQUEST_FD`` and writes each reply (a pickled list as above) to
+  ``RESULT_FD``, until the parent closes ``REQUEST_FD``. Requests do
+  not travel over stdin, which GNUBG may read when it prompts.
 """
 
-import os, sys, tempfile, json, platform
+import os, sys, tempfile, json, platform, threading, traceback
 from contextlib import contextmanager
 import gnubg  # REQUIRED when running under 'gnubg'
 
+# The parser lives next to this script; the parent tells us where that is
+sys.path.append(os.environ["XGID2ANKI_DIR"])
+from parse_gnubg_eval import parse_position
+
 try:
-    from StringIO import StringIO  # Py2
+    import cPickle as pickle  # Py2
 except ImportError:
-    from io import StringIO  # Py3
+    import pickle  # Py3
+
+# Only Windows builds need a throw-away "hint" before the real one
+NEEDS_WARMUP = platform.system().lower() == "windows"
+
+
+# suppress_fds() and capture_fds() run for every XGID, so the saved real
+# stdout/stderr and their redirect targets are set up once per process
+_REAL_OUT_FD = os.dup(1)
+_REAL_ERR_FD = os.dup(2)
+_DEVNULL_FD = os.open(os.devnull, os.O_WRONLY)
 
 
 @contextmanager
 def suppress_fds():
     """Silence all output to stdout/stderr at the OS fd level."""
-    old_out_fd = os.dup(1)
-    old_err_fd = os.dup(2)
-    devnull = open(os.devnull, "w")
     try:
-        os.dup2(devnull.fileno(), 1)
-        os.dup2(devnull.fileno(), 2)
+        os.dup2(_DEVNULL_FD, 1)
+        os.dup2(_DEVNULL_FD, 2)
         yield
     finally:
-        os.dup2(old_out_fd, 1)
-        os.dup2(old_err_fd, 2)
-        os.close(old_out_fd)
-        os.close(old_err_fd)
-        devnull.close()
+        os.dup2(_REAL_OUT_FD, 1)
+        os.dup2(_REAL_ERR_FD, 2)
+
+
+# The capture buffer is likewise reused. Nothing reads it until a command
+# returns (gnubg.command keeps the GIL, so a drain thread could not run
+# either), so a pipe only works where it can be enlarged past the longest
+# output; GNUBG would otherwise block forever in write(). That is Linux
+# (F_SETPIPE_SZ, 1031, unnamed on Python 2); elsewhere it stays a temp file.
+def _open_capture_pipe():
+    """Return (read_fd, write_fd) of an enlarged pipe, or None if unsupported."""
+    if not sys.platform.startswith("linux"):
+        return None
+    r, w = os.pipe()
+    try:
+        import fcntl
+
+        fcntl.fcntl(w, getattr(fcntl, "F_SETPIPE_SZ", 1031), 1 << 20)
+    except (ImportError, IOError, OSError):
+        os.close(r)
+        os.close(w)
+        return None
+    return r, w
+
+
+_CAPTURE_PIPE = _open_capture_pipe()
+_CAPTURE_TO_PIPE = _CAPTURE_PIPE is not None
+if _CAPTURE_TO_PIPE:
+    _CAPTURE_R, _CAPTURE_FD = _CAPTURE_PIPE
+else:
+    _CAPTURE_TMP = tempfile.TemporaryFile()
+    _CAPTURE_FD = _CAPTURE_TMP.fileno()
+
+# Written after each command so we know where its output on the pipe ends
+_CAPTURE_MARK = b"\0xgid2anki-end-of-capture\0"
+
+
+def _take_captured():
+    """Return (and drop) all bytes written to the capture buffer so far."""
+    if _CAPTURE_TO_PIPE:
+        os.write(_CAPTURE_FD, _CAPTURE_MARK)
+        data = bytearray()
+        while not data.endswith(_CAPTURE_MARK):
+            data.extend(os.read(_CAPTURE_R, 65536))
+        return bytes(data[: -len(_CAPTURE_MARK)])
+
+    _CAPTURE_TMP.seek(0)
+    data = _CAPTURE_TMP.read()
+    _CAPTURE_TMP.seek(0)
+    _CAPTURE_TMP.truncate()
+    return data
 
 
 @contextmanager
 def capture_fds():
     """
     Capture all output sent to stdout/stderr at the OS fd level.
-    Yields a temp file; caller must read before the context exits.
+    Yields a function returning the bytes captured since its last call;
+    caller must take everything before the context exits.
     """
-    old_out_fd = os.dup(1)
-    old_err_fd = os.dup(2)
-    tmp = tempfile.TemporaryFile()
     try:
-        os.dup2(tmp.fileno(), 1)
-        os.dup2(tmp.fileno(), 2)
-        yield tmp
+        os.dup2(_CAPTURE_FD, 1)
+        os.dup2(_CAPTURE_FD, 2)
+        yield _take_captured
     finally:
-        os.dup2(old_out_fd, 1)
-        os.dup2(old_err_fd, 2)
-        os.close(old_out_fd)
-        os.close(old_err_fd)
-        tmp.close()
+        os.dup2(_REAL_OUT_FD, 1)
+        os.dup2(_REAL_ERR_FD, 2)
 
 
-def run_with_no(func):
-    """Run func once, answering 'no' if prompted; discard all output."""
-    old_in = sys.stdin
-    sys.stdin = StringIO("no\n")
-    try:
-        with suppress_fds():
-            return func()
-    finally:
-        sys.stdin = old_in
+def answer_prompts_with_no():
+    """
+    Replace fd 0 with a pipe that a daemon thread keeps full of "no" lines, so
+    any GNUBG prompt (e.g. offering to swap players on "set xgid") reads "no".
+    """
+    r, w = os.pipe()
+    os.dup2(r, 0)
+    os.close(r)
 
+    answers = b"no\n" * 1024
 
-def capture_output(func):
-    """Run func once, capturing all stdout/stderr; return captured text."""
-    with capture_fds() as buff:
-        func()
-        buff.flush()
-        buff.seek(0)
-        data = buff.read()
-        if isinstance(data, bytes):
-            data = data.decode("utf-8", errors="replace")
-        return data
+    def feed():
+        while True:
+            # A write may be partial (over PIPE_BUF, 512 bytes on macOS), so
+            # resend the rest; as the only writer we keep the lines whole.
+            data = answers
+            while data:
+                data = data[os.write(w, data):]  # blocks while the pipe is full
+
+    feeder = threading.Thread(target=feed)
+    feeder.daemon = True
+    feeder.start()
+
+
+def capture_outputs(*funcs):
+    """
+    Run each func in turn under a single capture; return the text each one
+    produced, so several commands share one fd redirect.
+    """
+    texts = []
+    with capture_fds() as take_captured:
+        for func in funcs:
+            func()
+            texts.append(take_captured().decode("utf-8", errors="replace"))
+    return texts
 
 
 def print_to_tty(msg):
@@ -136,33 +219,88 @@ def print_to_tty(msg):
     return
 
 
-def write_result_json(result_obj):
+def write_result(result_obj):
     """
-    Dump result_obj (JSON-serializable) to RESULT_JSON_PATH.
-    Exit with a nonzero code if RESULT_JSON_PATH is missing or unwritable.
+    Pickle result_obj to RESULT_FD, or to RESULT_PATH where inherited fds are
+    unavailable (Windows).
+    Exit with a nonzero code if neither is set or the target is unwritable.
     """
-    out_path = os.environ.get("RESULT_JSON_PATH")
-    if not out_path:
-        # Hard failure: the parent promised us this.
-        sys.stderr.write("gnubg_pos_analysis: RESULT_JSON_PATH not set\n")
+    out_fd = os.environ.get("RESULT_FD")
+    out_path = os.environ.get("RESULT_PATH")
+    if not out_fd and not out_path:
+        # Hard failure: the parent promised us one of these.
+        sys.stderr.write("gnubg_pos_analysis: RESULT_FD / RESULT_PATH not set\n")
         sys.stderr.flush()
         sys.exit(1)
 
     try:
-        with open(out_path, "w") as fp:
-            json.dump(result_obj, fp)
+        if out_fd:
+            fp = os.fdopen(int(out_fd), "wb", 65536)
+        else:
+            fp = open(out_path, "wb")
+        with fp:
+            pickle.dump(result_obj, fp, pickle.HIGHEST_PROTOCOL)
     except Exception as e:
-        sys.stderr.write("gnubg_pos_analysis: failed to write JSON: %s\n" % e)
+        sys.stderr.write("gnubg_pos_analysis: failed to write result: %s\n" % e)
         sys.stderr.flush()
         sys.exit(1)
 
 
+def analyze_xgids(xgids):
+    """
+    Analyze each XGID in turn; return a list of parsed position dicts.
+    A position whose text cannot be parsed yields {"xgid", "error"} (the
+    traceback) instead, so the parent can report it without losing the worker.
+    """
+    output = []
+    for xgid in xgids:
+        print_to_tty('Analyzing "{}"...'.format(xgid))
+
+        # Set position (a swap prompt reads "no" from fd 0) and suppress chatter
+        with suppress_fds():
+            gnubg.command("set xgid %s" % xgid)
+
+        # Capture hint/eval (both stdout & stderr from gnubg during the calls)
+        # On Windows, first start with a warm-up / burn out
+        commands = ["hint", "hint", "eval"] if NEEDS_WARMUP else ["hint", "eval"]
+        texts = capture_outputs(*[lambda c=c: gnubg.command(c) for c in commands])
+        hint_txt, eval_txt = texts[-2:]
+
+        # Parse here so only the compact records cross the pipe
+        try:
+            output.append(
+                parse_position({"xgid": xgid, "hint": hint_txt, "eval": eval_txt})
+            )
+        except Exception:
+            output.append({"xgid": xgid, "error": traceback.format_exc()})
+
+    return output
+
+
+def serve_requests(request_fd, result_fd):
+    """
+    Worker mode: answer one JSON request per line on request_fd with one
+    pickled reply on result_fd, until the parent closes its end (EOF).
+    """
+    requests = os.fdopen(request_fd, "r")
+    results = os.fdopen(result_fd, "wb", 65536)
+    # readline() rather than iterating the file: Python 2's file iterator
+    # reads ahead and would block on a pipe waiting for more requests.
+    for line in iter(requests.readline, ""):
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        pickle.dump(analyze_xgids(request["xgids"]), results, pickle.HIGHEST_PROTOCOL)
+        results.flush()
+    requests.close()
+    results.close()
+
+
 if __name__ == "__main__":
-    # Load inputs
-    xgids = json.loads(os.environ["XGIDS"])
     ply = os.environ["PLIES"]
     cply = os.environ["CUBE_PLIES"]
-    output = []
+
+    answer_prompts_with_no()
 
     # Configure 3-ply, silently
     with suppress_fds():
@@ -172,20 +310,10 @@ if __name__ == "__main__":
         gnubg.command("set evaluation movefilter 3 1 -1 0 0")
         gnubg.command("set evaluation movefilter 3 2 6 0 0")
 
-    for xgid in xgids:
-        print_to_tty('Analyzing "{}"...'.format(xgid))
-
-        # Set position; if prompted to swap, auto-answer "no" and suppress chatter
-        run_with_no(lambda: gnubg.command("set xgid %s" % xgid))
-
-        # Capture hint/eval (both stdout & stderr from gnubg during the call)
-        # First start with a warm-up / burn out, which is required for Windows
-        capture_output(lambda: gnubg.command("hint"))
-        hint_txt = capture_output(lambda: gnubg.command("hint"))
-        eval_txt = capture_output(lambda: gnubg.command("eval"))
-
-        output.append({"xgid": xgid, "hint": hint_txt, "eval": eval_txt})
-
-    # Write the full batch result for the parent process to consume
-    write_result_json(output)
-    # After this point, gnubg will exit and the parent will read+delete the file.
+    if os.environ.get("REQUEST_FD"):
+        # Long-lived worker: keep the configured GNUBG around for many batches
+        serve_requests(int(os.environ["REQUEST_FD"]), int(os.environ["RESULT_FD"]))
+    else:
+        # One-shot: analyze XGIDS and write the full batch result for the parent
+        write_result(analyze_xgids(json.loads(os.environ["XGIDS"])))
+    # After this point, gnubg will exit and the parent sees EOF on its end.
@@ -7,18 +7,21 @@ xgid2anki.parse_gnubg_eval
 
 Parse and normalize GNUBG evaluation output into structured Python data.
 
-This module reads the JSON objects emitted by the GNUBG-side script
-(:mod:`xgid2anki.gnubg_pos_analysis`) and extracts the key information
-needed to build flashcards—typically equities, best moves, cube decisions,
+This module takes the raw ``hint``/``eval`` text captured by the GNUBG-side
+script (:mod:`xgid2anki.gnubg_pos_analysis`) and extracts the key information
+needed to build flashcards -- typically equities, best moves, cube decisions,
 and other metadata relevant for study.
 
 Responsibilities:
   1. Validate and normalize the raw analysis structure from GNUBG.
   2. Convert strings and numeric fields into consistent Python types.
-  3. Return a list of dictionaries, one per analyzed XGID.
+  3. Return one dictionary per analyzed XGID (:func:`parse_position`).
 
-Intended to be called from :func:`xgid2anki.pipeline.xgid2anki_pipeline`;
-it performs no I/O beyond reading the in-memory GNUBG results.
+Imported and called **inside GNUBG** by :mod:`xgid2anki.gnubg_pos_analysis`,
+so that only the compact parsed records travel back to the parent process.
+It must therefore stay standalone (no package-relative imports) and run on
+both Python 2 and Python 3. It performs no I/O beyond reading the in-memory
+GNUBG results.
 """
 
 import re
@@ -105,15 +108,19 @@ def parse_move_hint(position):
     }
 
 
-def parse_gnubg_eval(position_data):
-    positions = []
+def parse_position(pos):
+    move_type = pos["xgid"].split(":")[4]
+
+    if move_type in ["00", "D", "B", "R"]:  # if cube decision
+        return parse_cube_hint(pos, move_type)
+    else:  # if move decision
+        return parse_move_hint(pos)
 
-    for pos in position_data:
-        move_type = pos["xgid"].split(":")[4]
 
-        if move_type in ["00", "D", "B", "R"]:  # if cube decision
-            positions.append(parse_cube_hint(pos, move_type))
-        else:  # if move decision
-            positions.append(parse_move_hint(pos))
+def parse_gnubg_eval(position_data):
+    """Parse a list of raw positions; kept for API compatibility.
 
-    return positions
+    The package itself now calls :func:`parse_position` once per XGID inside
+    GNUBG.
+    """
+    return [parse_position(pos) for pos in position_data]
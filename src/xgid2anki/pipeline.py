@@ -4,16 +4,15 @@
 """xgid2anki.pipeline
 
 Orchestrates the end‑to‑end flow:
-  1) Run GNUBG analysis for the provided XGIDs.
-  2) Parse the GNUBG output into structured position data.
-  3) Augment positions with arrow overlays for board rendering.
-  4) Render board SVGs via bglog and bundle them into an Anki deck.
+  1) Run GNUBG analysis for the provided XGIDs (parsed into structured
+     position data inside GNUBG).
+  2) Augment positions with arrow overlays for board rendering.
+  3) Render board SVGs via bglog and bundle them into an Anki deck.
 """
 
 from __future__ import annotations
 
 from .xgid2svg import xgid2svg
-from .parse_gnubg_eval import parse_gnubg_eval
 from .build_deck import build_deck
 from .analyze_positions import analyze_positions
 
@@ -51,6 +50,7 @@ def xgid2anki_pipeline(
     board_theme: dict,
     keep_svg: bool,
     output_path: Path,
+    use_cache: bool = True,
 ) -> int:
     """Run the full pipeline, converting a set of XGIDs to an Anki deck
     Parameters
@@ -73,6 +73,8 @@ def xgid2anki_pipeline(
         If ``True``, keep the generated board SVG assets.
     cores
         Number of cores to be used in gnubg analysis.
+    use_cache
+        If ``True``, reuse cached GNUBG analyses from earlier runs.
 
     Returns
     -------
@@ -87,7 +89,9 @@ def xgid2anki_pipeline(
         plies,
         cube_ply,
     )
-    gnubg_analysis, rc = analyze_positions(xgids, cores, plies, cube_ply)
+    position_data, rc = analyze_positions(
+        xgids, cores, plies, cube_ply, use_cache
+    )
     logger.info("GNUBG analysis complete.")
 
     if rc != 0:
@@ -96,10 +100,6 @@ def xgid2anki_pipeline(
             rc,
         )
 
-    # Parse GNUBG analysis into useable dictionary
-    logger.info("Parsing GNUBG analysis.")
-    position_data = parse_gnubg_eval(gnubg_analysis)
-
     # Generate iterable consisting of xgids together with arrow data for move positions
     xgids_w_arrows = generate_arrows(position_data)
 
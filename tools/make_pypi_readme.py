@@ -11,6 +11,7 @@ into emoji blockquotes that render cleanly on PyPI, e.g.:
 """
 
 from pathlib import Path
+import io
 import re
 import sys
 
@@ -27,53 +28,59 @@ ADMO_MAP = {
 }
 
 # Regexes (note: use raw strings r'...' and do NOT double-escape backslashes)
-RE_ADMO_START = re.compile(r'^\s*>\s*\[!([A-Za-z]+)\]\s*$')  # e.g. "> [!NOTE]"
-RE_IS_QUOTED  = re.compile(r'^\s*>')                        # any line starting with ">"
+# One admonition block: the "> [!NOTE]" line plus every quoted line after it.
+RE_ADMO_BLOCK = re.compile(
+    r'^[ \t]*>[ \t]*\[!([A-Za-z]+)\][ \t]*(?:\n|\Z)'  # e.g. "> [!NOTE]"
+    r'((?:[ \t]*>.*(?:\n|\Z))*)',                   # its quoted content lines
+    re.M,
+)
+RE_QUOTE_STRIP = re.compile(r'^[ \t]*>[ \t]?')  # one leading ">" (+ one space)
 
-def convert(text: str) -> str:
-    lines = text.splitlines()
-    out = []
-    i = 0
-
-    while i < len(lines):
-        line = lines[i]
-        m = RE_ADMO_START.match(line)
-        if m:
-            kind = m.group(1).upper()
-            emoji, title = ADMO_MAP.get(kind, ("📝", kind.title()))
-
-            # Collect subsequent quoted lines (content), stripping one leading ">"
-            i += 1
-            content_lines = []
-            while i < len(lines) and RE_IS_QUOTED.match(lines[i]):
-                ln = lines[i]
-                # Strip exactly one leading quote marker and one optional space
-                ln = re.sub(r'^\s*>\s?', '', ln)
-                content_lines.append(ln)
-                i += 1
-
-            # Emit PyPI-friendly block
-            out.append(f"> {emoji} **{title}**")
-            out.append(">")
-            if content_lines:
-                for c in content_lines:
-                    out.append(f"> {c}")
-            else:
-                out.append("> ")
-            out.append("")  # blank line after the block
-            continue
-
-        # Not an admonition start; pass through
-        out.append(line)
-        i += 1
 
+def replace_admonition(m: re.Match) -> str:
+    """Render one matched admonition block as a PyPI-friendly blockquote."""
+    kind = m.group(1).upper()
+    emoji, title = ADMO_MAP.get(kind, ("📝", kind.title()))
+
+    # Strip exactly one leading quote marker and one optional space per line
+    content_lines = [
+        RE_QUOTE_STRIP.sub("", ln, count=1) for ln in m.group(2).splitlines()
+    ]
+
+    out = [f"> {emoji} **{title}**", ">"]
+    if content_lines:
+        out.extend(f"> {c}" for c in content_lines)
+    else:
+        out.append("> ")
+    out.append("")  # blank line after the block
     return "\n".join(out) + "\n"
 
 
+def write_converted(text: str, fo) -> None:
+    # One pass of the C regex engine over the whole document, writing the
+    # untouched text between admonitions straight through as slices
+    text = text.replace("\r\n", "\n")
+    pos = 0
+    for m in RE_ADMO_BLOCK.finditer(text):
+        fo.write(text[pos : m.start()])
+        fo.write(replace_admonition(m))
+        pos = m.end()
+    tail = text[pos:]
+    fo.write(tail)
+    if not tail.endswith("\n") and (tail or not pos):
+        fo.write("\n")  # always end with a newline, as a block already does
+
+
+def convert(text: str) -> str:
+    out = io.StringIO()
+    write_converted(text, out)
+    return out.getvalue()
+
+
 if __name__ == "__main__":
     if not SRC.exists():
         print(f"ERROR: README not found at {SRC}", file=sys.stderr)
         sys.exit(1)
-    text = SRC.read_text(encoding="utf-8")
-    DST.write_text(convert(text), encoding="utf-8")
+    with SRC.open("r", encoding="utf-8") as fi, DST.open("w", encoding="utf-8") as fo:
+        write_converted(fi.read(), fo)
     print(f"Wrote {DST}")